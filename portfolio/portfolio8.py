@@ -1,133 +1,401 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import yfinance as yf
-import matplotlib.pyplot as plt
-from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import io
+import json
+import os
+import time
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+
+# yfinance の取得結果を保存するディスクキャッシュ
+CACHE_DIR = Path.home() / ".cache" / "family_portfolio"
+PRICE_TTL = 900          # 終値は15分
+SECTOR_TTL = 86400 * 30  # セクターはほぼ変わらないので30日
+
+DEFAULT_USD_JPY = 155.0  # 為替取得前の初期値・取得失敗時のフォールバック
 
 # ========== キャッシュ付き関数群 ==========
 
 @st.cache_data(ttl=3600)
 def get_usd_to_jpy():
-    """Yahoo Financeから最新USD/JPYレートを取得。失敗時は155円にフォールバック。"""
+    """Yahoo Financeから最新USD/JPYレートを取得。失敗時は DEFAULT_USD_JPY にフォールバック。"""
     try:
         rate = yf.Ticker("USDJPY=X").history(period="1d")["Close"].iloc[-1]
         return float(rate)
     except Exception as e:
-        st.warning(f"為替取得失敗。155円を使用します。詳細: {e}")
-        return 155.0
+        st.warning(f"為替取得失敗。{DEFAULT_USD_JPY:.0f}円を使用します。詳細: {e}")
+        return DEFAULT_USD_JPY
 
 
-@st.cache_data(ttl=3600)
-def fetch_csv_from_github(url):
+@st.cache_resource
+def get_http_session():
+    """GitHubへの接続を再利用する (keep-alive) ための共有セッション。"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+    return session
+
+
+@st.cache_resource
+def _csv_etag_store():
+    # url -> (ETag, DataFrame)。304 Not Modified のときに再利用する
+    return {}
+
+
+@st.cache_data
+def parse_csv(data: bytes):
+    """アップロードされたCSVを解析。内容が同じなら再解析しない。"""
+    return _to_categories(_normalize_columns(pd.read_csv(io.BytesIO(data), engine="pyarrow")))
+
+
+def _csv_from_response(url, r, store):
+    """GitHubの応答を DataFrame にする。304 なら前回の結果を返す。"""
+    cached = store.get(url)
+    if r.status_code == 304 and cached:
+        return cached[1].copy()
+
+    # 通信エラーと区別できるよう、解析エラーは別に捕まえる
     try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        df = pd.read_csv(io.StringIO(r.text), encoding="utf-8")
-        df.columns = df.columns.str.strip().str.replace("　", "")
-        return df
+        df = pd.read_csv(io.BytesIO(r.content), engine="pyarrow")
     except Exception as e:
-        st.warning(f"GitHub CSV取得失敗: {e}")
+        st.warning(f"GitHub CSV解析失敗 ({url}): {e}")
         return pd.DataFrame()
 
+    df = _to_categories(_normalize_columns(df))
+    etag = r.headers.get("ETag")
+    if etag:
+        store[url] = (etag, df.copy())
+    return df
 
-@st.cache_data(ttl=3600)
-def load_prices_and_sector(tickers):
-    prices, sectors = {}, {}
-    for t in tickers:
+
+# ETag で再検証するので短めのTTLでも再ダウンロード・再解析は起きにくい
+@st.cache_data(ttl=300)
+def fetch_csvs_from_github(urls):
+    """GitHub上の複数CSVを並列に取得する。取得できなかったものは空の DataFrame。"""
+    store = _csv_etag_store()
+    session = get_http_session()
+
+    def request(url):
+        # スレッドで実行するので st.* は呼ばない
+        cached = store.get(url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
         try:
-            ticker = yf.Ticker(t)
-            hist = ticker.history(period="5d")
-            if hist.empty:
-                prices[t] = None
-            else:
-                prices[t] = float(hist["Close"].dropna().iloc[-1])
+            r = session.get(url, timeout=10, headers=headers)
+            r.raise_for_status()
+            return r, None
+        except requests.RequestException as e:
+            return None, e
+
+    with ThreadPoolExecutor(max_workers=len(urls)) as ex:
+        responses = list(ex.map(request, urls))
+
+    dfs = []
+    for url, (r, err) in zip(urls, responses):
+        if err is not None:
+            st.warning(f"GitHub CSV取得失敗: {err}")
+            dfs.append(pd.DataFrame())
+        else:
+            dfs.append(_csv_from_response(url, r, store))
+    return dfs
+
+
+class FileCache:
+    """{root}/{ticker}/{endpoint}.json に値を取得時刻つきで保存する簡易キャッシュ。"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, ticker, endpoint):
+        # ティッカーはアップロードされたCSV由来なので、"/" や ".." を含んでも
+        # root の外に出ないようエスケープしてからディレクトリ名にする
+        name = quote(ticker, safe="").replace(".", "%2E")
+        return self.root / name / f"{endpoint}.json"
+
+    def get(self, ticker, endpoint, ttl):
+        """ttl 秒以内に保存された値を返す。無い・古い・壊れている場合は None。"""
+        try:
+            entry = json.loads(self._path(ticker, endpoint).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict):
+            return None
+        if time.time() - entry.get("timestamp", 0) > ttl:
+            return None
+        return entry.get("value")
+
+    def set(self, ticker, endpoint, value, **meta):
+        path = self._path(ticker, endpoint)
+        entry = {"value": value, "timestamp": time.time(), **meta}
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            pass  # 書き込めなくても次回取り直すだけなので無視
 
-            if t.endswith("-USD"):
-                sectors[t] = "Crypto"
+
+YF_CACHE = FileCache(CACHE_DIR)
+
+
+def _download_closes(tickers):
+    """複数銘柄の直近終値を yf.download の1リクエストでまとめて取得。"""
+    data = yf.download(list(tickers), period="5d", group_by="ticker",
+                       threads=True, progress=False, auto_adjust=False)
+    prices = {}
+    for t in tickers:
+        try:
+            if isinstance(data.columns, pd.MultiIndex):
+                close = data[t]["Close"].dropna()
             else:
-                info = getattr(ticker, "info", {})
-                if isinstance(info, dict):
-                    sectors[t] = info.get("sector", "Unknown")
-                else:
-                    sectors[t] = "Unknown"
-        except Exception as e:
-            st.warning(f"{t} のデータ取得失敗: {e}")
+                close = data["Close"].dropna()
+        except KeyError:
             prices[t] = None
-            sectors[t] = "Unknown"
-    return prices, sectors
+            continue
+        prices[t] = None if close.empty else float(close.iloc[-1])
+    return prices
 
 
-# ========== ユーティリティ関数 ==========
+def _fetch_sector(t):
+    # スレッドから呼ばれるので st.* は使わない
+    if t.endswith("-USD"):
+        return "Crypto"
+    try:
+        info = yf.Ticker(t).info
+    except Exception:
+        return "Unknown"
+    if isinstance(info, dict):
+        return info.get("sector", "Unknown")
+    return "Unknown"
+
+
+@st.cache_data(ttl=PRICE_TTL)
+def load_prices(tickers):
+    """直近終値を取得。PRICE_TTL 秒以内にディスクキャッシュした銘柄は再取得しない。"""
+    prices, misses = {}, []
+    for t in tickers:
+        price = YF_CACHE.get(t, "price", ttl=PRICE_TTL)
+        if price is None:
+            misses.append(t)
+        else:
+            prices[t] = price
+
+    if not misses:
+        return prices
 
-def guess_currency(ticker: str) -> str:
-    if ticker.endswith(".T"):
-        return "JPY"
-    return "USD"
+    try:
+        fetched = _download_closes(misses)
+    except Exception as e:
+        st.warning(f"価格データ取得失敗: {e}")
+        fetched = {}
 
+    for t in misses:
+        prices[t] = fetched.get(t)
+        # 価格が取れなかった銘柄はキャッシュしない（次回再取得する）
+        if prices[t] is not None:
+            YF_CACHE.set(t, "price", prices[t], yfinance=yf.__version__)
+    return prices
 
-def calculate_portfolio(df, FX_TO_JPY, FEE_RATE):
-    df.columns = df.columns.str.strip().str.replace("　", "")
 
-    tickers_target = df[df["asset_type"].isin(["stock","crypto"])]["ticker"].unique()
-    prices, sectors = load_prices_and_sector(tickers_target)
+@st.cache_data(ttl=SECTOR_TTL)
+def load_sectors(tickers):
+    """セクターを取得。SECTOR_TTL 秒以内にディスクキャッシュした銘柄は再取得しない。"""
+    sectors, misses = {}, []
+    for t in tickers:
+        sector = YF_CACHE.get(t, "sector", ttl=SECTOR_TTL)
+        if sector is None:
+            misses.append(t)
+        else:
+            sectors[t] = sector
 
-    df["currency"] = df.get("currency", df["ticker"].map(guess_currency))
-    df["fee"] = 0
+    if not misses:
+        return sectors
 
-    mask_equity = df["asset_type"].isin(["stock","crypto"])
-    df.loc[mask_equity, "fee"] = df.loc[mask_equity, "buy_price"] * df.loc[mask_equity, "shares"] * FEE_RATE
+    # .info は銘柄ごとのHTTPリクエストなのでスレッドで並列化
+    with ThreadPoolExecutor(max_workers=min(16, len(misses))) as ex:
+        sectors.update(zip(misses, ex.map(_fetch_sector, misses)))
 
-    df["prev_close"] = df["ticker"].map(prices)
-    df["sector"] = df.get("sector", df["ticker"].map(lambda t: sectors.get(t, "Cash")))
+    for t in misses:
+        # 取得失敗 (Unknown) はキャッシュしない
+        if sectors[t] != "Unknown":
+            YF_CACHE.set(t, "sector", sectors[t], yfinance=yf.__version__)
+    return sectors
 
-    df["market_value"] = 0
-    df["cost_basis"]  = 0
-    df.loc[mask_equity, "market_value"] = df.loc[mask_equity, "shares"] * df.loc[mask_equity, "prev_close"]
-    df.loc[mask_equity, "cost_basis"]  = df.loc[mask_equity, "shares"] * df.loc[mask_equity, "buy_price"] + df.loc[mask_equity, "fee"]
 
-    mask_cash = df["asset_type"]=="cash"
-    df.loc[mask_cash, "market_value"] = df.loc[mask_cash, "shares"]
-    df.loc[mask_cash, "cost_basis"]  = df.loc[mask_cash, "shares"]
+# ========== ユーティリティ関数 ==========
 
-    df["pnl_abs"] = df["market_value"] - df["cost_basis"]
-    df["pnl_pct"] = df["pnl_abs"] / df["cost_basis"] * 100
+_FULLWIDTH_SPACE = {0x3000: None}
 
-    df["fx_to_jpy"] = df["currency"].map(FX_TO_JPY).fillna(1.0)
-    df["mv_jpy"]    = df["market_value"] * df["fx_to_jpy"]
-    df["cost_jpy"]  = df["cost_basis"]   * df["fx_to_jpy"]
-    df["pnl_jpy"]   = df["mv_jpy"] - df["cost_jpy"]
 
-    total_pnl = df["pnl_jpy"].sum()
-    df["pnl_contrib"] = df["pnl_jpy"] / total_pnl * 100 if total_pnl != 0 else 0
-    df["pnl_over_mv_pct"] = df["pnl_jpy"] / df["mv_jpy"] * 100
+def _normalize_columns(df):
+    """列名の前後空白と全角スペースを除去。CSV読み込み時に一度だけ呼ぶ。"""
+    df.columns = [c.strip().translate(_FULLWIDTH_SPACE) for c in df.columns]
+    return df
 
-    if "realized_pnl_jpy" not in df.columns:
-        df["realized_pnl_jpy"] = 0.0
 
+def _to_categories(df):
+    """種類の少ない文字列列を読み込み時に category へ変換（比較・groupby を整数コードで行う）。"""
+    for c in ("asset_type", "currency", "sector"):
+        if c in df.columns:
+            df[c] = df[c].astype("category")
     return df
 
 
-def color_pnl_pct(val):
-    try:
-        val = float(val)
-    except:
-        return ''
-    if val > 0:
-        intensity = min(val / 50.0, 1.0)
-        r = int(144 - 144 * intensity)
-        g = int(238 - 38 * intensity)
-        b = int(144 - 144 * intensity)
-        return f'background-color: rgb({r}, {g}, {b})'
-    elif val < 0:
-        intensity = min(abs(val) / 50.0, 1.0)
-        r = 255
-        g = int(200 - 200 * intensity)
-        b = int(200 - 200 * intensity)
-        return f'background-color: rgb({r}, {g}, {b})'
-    else:
-        return ''
+def guess_currency(tickers: pd.Series) -> pd.Series:
+    """ティッカーから通貨を推定（.T は東証なのでJPY、それ以外はUSD）。"""
+    return pd.Series(np.where(tickers.str.endswith(".T"), "JPY", "USD"), index=tickers.index)
+
+
+def _target_tickers(df):
+    """株・暗号資産の銘柄をソート済みタプルで返す（行の並びに左右されないキャッシュキー）。"""
+    if "asset_type" not in df.columns:
+        return ()
+    t = df.loc[df["asset_type"].isin(["stock","crypto"]), "ticker"]
+    # ティッカー欄が空の行（pyarrow では None）は並べ替えもファイル名化もできないので除く
+    t = t.dropna().astype(str).str.strip()
+    return tuple(sorted(set(t[t != ""])))
+
+
+# 価格とセクターは呼び出し側で取得し、(ticker, 値) のタプルで受け取る。
+# 引数だけで結果が決まるので、価格が更新されればキャッシュキーも変わる
+@st.cache_data(ttl=PRICE_TTL)
+def calculate_portfolio(df, FX_TO_JPY, FEE_RATE, prices, sectors):
+    # CSV取得失敗などで空のときは計算せずに空の結果を返す
+    if df.empty or "asset_type" not in df.columns:
+        empty = df.iloc[0:0].assign(mv_jpy=[], pnl_jpy=[], realized_pnl_jpy=[], fee=[])
+        return empty, {"pnl_jpy": 0.0, "mv_jpy": 0.0, "fee": 0.0, "realized": 0.0}
+
+    # ticker順に並べておき、後段の groupby を整列済みキーで処理させる（元の df は変更しない）
+    df = df.sort_values("ticker", kind="stable", ignore_index=True)
+    prices, sectors = dict(prices), dict(sectors)
+
+    # 追加する列はすべて new_cols に集め、最後に df.assign で一度に付け足す
+    new_cols = {}
+
+    # df.get(col, default) は default を先に評価してしまうので列の有無で分岐する
+    currency = df["currency"] if "currency" in df.columns else guess_currency(df["ticker"])
+    prev_close = df["ticker"].map(prices)
+    if "sector" not in df.columns:
+        sector_series = pd.Series(sectors, name="sector", dtype=object)
+        new_cols["sector"] = df["ticker"].map(sector_series).fillna("Cash")
+
+    # 列を numpy 配列として一度だけ取り出し、まとめて計算する
+    mask_equity = df["asset_type"].isin(["stock","crypto"]).to_numpy()
+    mask_cash   = (df["asset_type"] == "cash").to_numpy()
+    s  = df["shares"].to_numpy(float)
+    bp = df["buy_price"].to_numpy(float)
+    pc = prev_close.to_numpy(float)
+
+    # 現金は数量そのもの、それ以外は0で初期化し、株・暗号資産の行だけ
+    # 時価と取得額(手数料込)で上書きする
+    idx_equity = np.flatnonzero(mask_equity)
+    base = np.where(mask_cash, s, 0.0)
+    fee = np.zeros(len(df))
+    mv  = base.copy()
+    cb  = base
+    s_eq, bp_eq = s[idx_equity], bp[idx_equity]
+    fee[idx_equity] = bp_eq * s_eq * FEE_RATE
+    mv[idx_equity]  = s_eq * pc[idx_equity]
+    cb[idx_equity]  = s_eq * bp_eq + fee[idx_equity]
+    pnl_abs = mv - cb
+
+    # 為替レートは通貨カテゴリごとの小さな表を作り、カテゴリコードで引く（未知の通貨は1.0）
+    # 表の末尾の1.0は欠損値（コード -1）用
+    cur = currency.astype("category")
+    fx_table = FX_TO_JPY.reindex(cur.cat.categories).fillna(1.0).to_numpy(float)
+    fx = np.append(fx_table, 1.0)[cur.cat.codes.to_numpy()]
+
+    # 円換算3列は1つの配列にまとめて書き込む
+    out = np.empty((len(df), 3), dtype=float)
+    np.multiply(mv, fx, out=out[:, 0])
+    np.multiply(cb, fx, out=out[:, 1])
+    np.subtract(out[:, 0], out[:, 1], out=out[:, 2])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pnl_pct = pnl_abs / cb * 100
+        pnl_over_mv_pct = out[:, 2] / out[:, 0] * 100
+
+    new_cols.update(
+        currency=cur,
+        fee=fee,
+        prev_close=prev_close,
+        market_value=mv,
+        cost_basis=cb,
+        pnl_abs=pnl_abs,
+        pnl_pct=pnl_pct,
+        fx_to_jpy=fx,
+        mv_jpy=out[:, 0],
+        cost_jpy=out[:, 1],
+        pnl_jpy=out[:, 2],
+        pnl_over_mv_pct=pnl_over_mv_pct,
+    )
+    if "realized_pnl_jpy" not in df.columns:
+        new_cols["realized_pnl_jpy"] = 0.0
+    df = df.assign(**new_cols)
+
+    # CSVに無く計算中に補った列も category に揃える
+    _to_categories(df)
+
+    # 合計値はここで一度だけ計算し、呼び出し側で使い回す
+    totals = {
+        "pnl_jpy": df["pnl_jpy"].sum(),
+        "mv_jpy": df["mv_jpy"].sum(),
+        "fee": df["fee"].sum(),
+        "realized": df["realized_pnl_jpy"].sum(),
+    }
+    return df, totals
+
+
+def color_pnl_col(s: pd.Series) -> np.ndarray:
+    """損益率の列をまとめて受け取り、セルごとの背景色CSSを返す（正:緑、負:赤）。"""
+    vals = pd.to_numeric(s, errors="coerce").to_numpy(float)
+    pos = vals > 0
+    neg = vals < 0
+    intensity = np.nan_to_num(np.clip(np.abs(vals) / 50.0, 0.0, 1.0))
+    r = np.where(pos, 144 - 144 * intensity, 255).astype(int)
+    g = np.where(pos, 238 - 38 * intensity, 200 - 200 * intensity).astype(int)
+    b = np.where(pos, 144 - 144 * intensity, 200 - 200 * intensity).astype(int)
+    css = np.array([f"background-color: rgb({r_}, {g_}, {b_})" for r_, g_, b_ in zip(r, g, b)], dtype=object)
+    return np.where(pos | neg, css, "")
+
+
+def show_pie(values: pd.Series, title: str):
+    """円グラフを Vega-Lite で描画。描画はブラウザ側で行うのでサーバーでの画像生成が不要。"""
+    data = pd.DataFrame({"label": values.index.astype(str), "value": values.to_numpy(np.float64)})
+    spec = {
+        "title": title,
+        "height": 360,
+        "transform": [
+            {"joinaggregate": [{"op": "sum", "field": "value", "as": "total"}]},
+            {"calculate": "datum.value / datum.total", "as": "ratio"},
+            {"calculate": "datum.label + ' ' + format(datum.ratio, '.1%')", "as": "caption"},
+        ],
+        "encoding": {
+            "theta": {"field": "value", "type": "quantitative", "stack": True},
+            "color": {"field": "label", "type": "nominal", "sort": None, "legend": None},
+        },
+        # タップでは tooltip が出ないので、銘柄名と比率は各スライスの外側に直接描く
+        "layer": [
+            {
+                "mark": {"type": "arc", "outerRadius": 120},
+                "encoding": {
+                    "tooltip": [
+                        {"field": "label", "type": "nominal"},
+                        {"field": "ratio", "type": "quantitative", "format": ".1%"},
+                    ],
+                },
+            },
+            {
+                "mark": {"type": "text", "radius": 145},
+                "encoding": {"text": {"field": "caption", "type": "nominal"}},
+            },
+        ],
+    }
+    st.vega_lite_chart(data, spec, use_container_width=True)
 
 
 # ========== Streamlit UI ==========
@@ -137,12 +405,12 @@ st.title("📊 家族で共有できる資産管理アプリ（軽量・キャ
 
 # 手動更新式 為替管理
 if "usd_jpy" not in st.session_state:
-    st.session_state["usd_jpy"] = 155.0  # 初期値
+    st.session_state["usd_jpy"] = DEFAULT_USD_JPY
 
 if st.button("💱 為替レートを更新"):
     st.session_state["usd_jpy"] = get_usd_to_jpy()
 
-FX_TO_JPY = {"USD": st.session_state["usd_jpy"], "JPY": 1.0}
+FX_TO_JPY = pd.Series({"USD": st.session_state["usd_jpy"], "JPY": 1.0})
 st.info(f"現在のUSD/JPYレート: {FX_TO_JPY['USD']:.2f}")
 
 # ファイル読み込み
@@ -152,26 +420,38 @@ TRADES_CSV_URL    = "https://raw.githubusercontent.com/hayatonn/family_portfolio
 uploaded_portfolio = st.file_uploader("ポートフォリオCSVをアップロード", type=["csv"])
 uploaded_trades    = st.file_uploader("売買履歴CSVをアップロード", type=["csv"])
 
+# アップロードされなかったCSVだけGitHubからまとめて（並列に）取得する
+github_urls = tuple(url for url, uploaded in [(PORTFOLIO_CSV_URL, uploaded_portfolio),
+                                              (TRADES_CSV_URL, uploaded_trades)] if not uploaded)
+fetched = dict(zip(github_urls, fetch_csvs_from_github(github_urls))) if github_urls else {}
+
 if uploaded_portfolio:
-    df_portfolio = pd.read_csv(uploaded_portfolio, encoding="utf-8-sig")
+    df_portfolio = parse_csv(uploaded_portfolio.getvalue())
 else:
-    df_portfolio = fetch_csv_from_github(PORTFOLIO_CSV_URL)
+    df_portfolio = fetched[PORTFOLIO_CSV_URL]
 
 if uploaded_trades:
-    df_trades = pd.read_csv(uploaded_trades, encoding="utf-8-sig")
+    df_trades = parse_csv(uploaded_trades.getvalue())
 else:
-    df_trades = fetch_csv_from_github(TRADES_CSV_URL)
+    df_trades = fetched[TRADES_CSV_URL]
 
 # 計算
 FEE_RATE = 0.00495
-df_portfolio = calculate_portfolio(df_portfolio, FX_TO_JPY, FEE_RATE)
+tickers_target = _target_tickers(df_portfolio)
+prices = load_prices(tickers_target)
+sectors = load_sectors(tickers_target)
+df_portfolio, totals = calculate_portfolio(df_portfolio, FX_TO_JPY, FEE_RATE,
+                                           tuple(sorted(prices.items())), tuple(sorted(sectors.items())))
+if df_portfolio.empty:
+    st.info("ポートフォリオのデータがありません。CSVをアップロードしてください。")
+    st.stop()
 
 # 表示
 st.subheader("銘柄別集計")
-total_pnl = df_portfolio["pnl_jpy"].sum()
+total_pnl = totals["pnl_jpy"]
 df_portfolio["pnl_ratio_pct"] = df_portfolio["pnl_jpy"] / total_pnl * 100 if total_pnl != 0 else 0
 
-ticker_summary = df_portfolio.groupby("ticker").agg({
+ticker_summary = df_portfolio.groupby("ticker", sort=False, observed=True).agg({
     "asset_type": "first",
     "shares": "sum",
     "buy_price": "mean",
@@ -185,17 +465,21 @@ ticker_summary = df_portfolio.groupby("ticker").agg({
     "pnl_over_mv_pct": "mean",
     "sector": "first"
 }).reset_index()
+# 円グラフ用（ticker順）。同じ集計を groupby し直さずに使い回す
+latest_assets = ticker_summary.set_index("ticker")["mv_jpy"]
 
 ticker_summary = ticker_summary.sort_values("pnl_pct", ascending=False)
-styled_df = ticker_summary.style.applymap(color_pnl_pct, subset=["pnl_pct"])
+styled_df = ticker_summary.style.apply(color_pnl_col, subset=["pnl_pct"])
 st.dataframe(styled_df, use_container_width=True)
 
 # セクター別寄与度
 st.subheader("セクター別寄与度")
-sector_df = df_portfolio.groupby("sector").agg(
+by_sector = df_portfolio.groupby("sector", sort=False, observed=True).agg(
     mv_jpy=("mv_jpy","sum"),
     pnl_jpy=("pnl_jpy","sum")
-).reset_index()
+)
+sector_assets = by_sector["mv_jpy"]
+sector_df = by_sector.reset_index()
 sector_df["mv_contrib_pct"] = sector_df["mv_jpy"] / sector_df["mv_jpy"].sum() * 100
 sector_df["pnl_ratio_pct"] = sector_df["pnl_jpy"] / total_pnl * 100 if total_pnl != 0 else 0
 sector_df["pnl_over_mv_pct"] = sector_df["pnl_jpy"] / sector_df["mv_jpy"] * 100
@@ -203,10 +487,10 @@ st.dataframe(sector_df)
 
 # 合計
 st.subheader("合計")
-total_mv = df_portfolio["mv_jpy"].sum()
-total_unrealized = df_portfolio["pnl_jpy"].sum()
-total_realized = df_portfolio["realized_pnl_jpy"].sum()
-total_fee = df_portfolio["fee"].sum()
+total_mv = totals["mv_jpy"]
+total_unrealized = totals["pnl_jpy"]
+total_realized = totals["realized"]
+total_fee = totals["fee"]
 st.metric("評価額合計 (JPY)", f"{total_mv:,.0f}")
 st.metric("含み損益 (JPY)", f"{total_unrealized:,.0f}")
 st.metric("確定損益 (JPY)", f"{total_realized:,.0f}")
@@ -215,15 +499,7 @@ st.metric("合計手数料 (JPY)", f"{total_fee * FX_TO_JPY['USD']:,.0f}")
 
 # グラフ
 st.subheader("資産別寄与度（円グラフ）")
-latest_assets = df_portfolio.groupby("ticker")["mv_jpy"].sum()
-fig, ax = plt.subplots()
-ax.pie(latest_assets.values, labels=latest_assets.index, autopct="%1.1f%%", startangle=90)
-ax.set_title("stock_ratio")
-st.pyplot(fig)
+show_pie(latest_assets, "stock_ratio")
 
 st.subheader("セクター別資産比率")
-sector_assets = df_portfolio.groupby("sector")["mv_jpy"].sum()
-fig2, ax2 = plt.subplots()
-ax2.pie(sector_assets.values, labels=sector_assets.index, autopct="%1.1f%%", startangle=90)
-ax2.set_title("sector_ratio")
-st.pyplot(fig2)
+show_pie(sector_assets, "sector_ratio")